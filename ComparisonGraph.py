@@ -0,0 +1,104 @@
+from collections import deque
+
+
+def get_fic_key(fic):
+    """
+    Get a stable graph key for a fic.
+
+    Fics with deep-fetched text get a separate key, because verdicts made with the
+    opening of chapter 1 shouldn't be mixed with verdicts made from the blurb alone.
+    """
+    key = fic.get('work_id') or fic.get('url') or fic.get('title')
+    if fic.get('opening_text'):
+        key = f"{key}:deep"
+    return key
+
+
+class ComparisonGraph:
+    def __init__(self):
+        """
+        Initialize the ComparisonGraph class.
+
+        Stores every pairwise verdict as a directed edge from winner to loser. If a fic
+        beat one that beat another, the first is inferred to beat the last without
+        asking the LLM again.
+        """
+        self.edges = {}
+        self.cycles = []
+        self.recorded = 0
+        self.inferred = 0
+
+    def __reaches(self, start, target):
+        """Breadth-first search for a winner -> ... -> loser path from start to target."""
+        if start == target:
+            return False
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for next_node in self.edges.get(node, ()):
+                if next_node == target:
+                    return True
+                if next_node not in seen:
+                    seen.add(next_node)
+                    queue.append(next_node)
+        return False
+
+    def lookup(self, fic1, fic2):
+        """
+        Answer a comparison from recorded verdicts.
+
+        Returns True if fic1 is known to beat fic2, False if fic2 is known to beat fic1,
+        or None if the graph can't tell.
+        """
+        key1, key2 = get_fic_key(fic1), get_fic_key(fic2)
+        if key1 not in self.edges and key2 not in self.edges:
+            # Neither fic has beaten anything yet, so no path can exist
+            return None
+        if self.__reaches(key1, key2):
+            self.inferred += 1
+            return True
+        if self.__reaches(key2, key1):
+            self.inferred += 1
+            return False
+        return None
+
+    def record(self, fic1, fic2, fic1_wins):
+        """
+        Record a verdict between two fics.
+
+        A verdict that contradicts what the graph already implies would create a
+        preference cycle. It is reported and kept in `cycles`, but not added, so the
+        earlier verdicts stay consistent. (Callers normally lookup() first, so this is
+        a safeguard for verdicts recorded without one.)
+
+        Returns True if the verdict was added, False if it was rejected as a cycle.
+        """
+        winner, loser = (fic1, fic2) if fic1_wins else (fic2, fic1)
+        winner_key, loser_key = get_fic_key(winner), get_fic_key(loser)
+        if winner_key == loser_key:
+            return False
+
+        if self.__reaches(loser_key, winner_key):
+            self.cycles.append((winner_key, loser_key))
+            print(f"Preference cycle: '{winner['title']}' beat '{loser['title']}', "
+                  f"but earlier verdicts rank '{loser['title']}' higher. Keeping the earlier verdicts.")
+            return False
+
+        self.edges.setdefault(winner_key, set()).add(loser_key)
+        self.recorded += 1
+        return True
+
+    def record_conflict(self, fic1, fic2):
+        """
+        Record that the LLM contradicted itself on a pair.
+
+        Used when asking the same pair in both orders gives opposite answers, i.e. a
+        two-fic preference cycle (each fic beat the other). No edge is added.
+        """
+        self.cycles.append((get_fic_key(fic1), get_fic_key(fic2)))
+        print(f"Preference cycle: '{fic1['title']}' and '{fic2['title']}' each won depending on which was listed first")
+
+    def get_stats(self):
+        """Summary counts of recorded verdicts, inferred answers and rejected cycles."""
+        return {'recorded': self.recorded, 'inferred': self.inferred, 'cycles': len(self.cycles)}
@@ -3,16 +3,25 @@ import json
 import subprocess
 import asyncio
 import aiohttp
+import random
+import time
+from collections import deque
 
 
 class OllamaAI:
-    def __init__(self, model: str = "goekdenizguelmez/JOSIEFIED-Qwen3:4b", preset_mode: int = 0, discard_token: str = None, documents: str = None, max_history_pairs: int = 3):
+    def __init__(self, model: str = "goekdenizguelmez/JOSIEFIED-Qwen3:4b", preset_mode: int = 0, discard_token: str = None, documents: str = None, max_history_pairs: int = 3,
+                 cascade_model: str = None, cascade_budget: int = 0, request_timeout: float = 120, max_retries: int = 2, hedge_percentile: float = 0.95):
         """
         Initialize the OllamaAI class.
 
         model: str - The model that the AI should use for generating responses.
         preset_mode: int - The preset personality for the AI.
         max_history_pairs: int - Maximum number of user-assistant message pairs to keep in history (default: 3).
+        cascade_model: str - Optional larger model for escalated (close-call) requests.
+        cascade_budget: int - Maximum number of requests that may be escalated to cascade_model.
+        request_timeout: float - Deadline (seconds) for each individual async request attempt.
+        max_retries: int - Number of times a failed or timed-out async request is retried, with backoff.
+        hedge_percentile: float - Latency percentile after which a duplicate (hedge) request is sent. None disables hedging.
         """
         self.model = model
         self.options = {
@@ -22,7 +31,20 @@ class OllamaAI:
         }
         self.discard_token = discard_token #########################################################
         self.max_history_pairs = max_history_pairs
+        self.cascade_model = cascade_model
+        self.cascade_budget = cascade_budget
+        self.cascade_calls = 0
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = 20
+        self.latencies = {}
+        self.hedges_sent = 0
+        self.hedges_won = 0
         self.__load_model_into_memory()
+        if self.cascade_model:
+            self.cascade_options = dict(self.options, num_ctx=self.get_context_window_size(self.cascade_model))
+            self.__load_model_into_memory(self.cascade_model)
         self.preset_mode = preset_mode
         self.chat_history = []
         
@@ -47,8 +69,8 @@ class OllamaAI:
     def __append_system_message(self):
         self.chat_history.append({"role": "system", "content": self.system_message})
 
-    def __load_model_into_memory(self):
-        data = {"model": self.model}
+    def __load_model_into_memory(self, model=None):
+        data = {"model": model or self.model}
         response = requests.post(
             "http://localhost:11434/api/chat", data=json.dumps(data)
         )
@@ -84,25 +106,103 @@ class OllamaAI:
         response_json = response.json()
         return response_json["message"]["content"]
     
-    async def send_message_async(self, message, session):
-        """Async version of send_message that doesn't modify chat history."""
+    def can_escalate(self):
+        """Whether a cascade model is set and its budget isn't used up yet."""
+        return bool(self.cascade_model) and self.cascade_calls < self.cascade_budget
+
+    async def send_message_async(self, message, session, escalate=False):
+        """
+        Async version of send_message that doesn't modify chat history.
+
+        escalate: bool - Send to cascade_model instead of model. Counts against cascade_budget.
+        """
+        if escalate and not self.can_escalate():
+            raise RuntimeError("No cascade model budget left to escalate this request")
+
+        model = self.cascade_model if escalate else self.model
+        options = self.cascade_options if escalate else self.options
+        if escalate:
+            self.cascade_calls += 1
+
         messages = self.chat_history.copy()
         message_obj = {
             "role": "user",
             "content": message,
-            "options": self.options
+            "options": options
         }
         messages.append(message_obj)
         
-        data = {"model": self.model, "messages": messages, "stream": False}
+        data = {"model": model, "messages": messages, "stream": False}
         
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.__send_hedged_async(data, session)
+            except (asyncio.TimeoutError, aiohttp.ClientError, KeyError, ValueError) as e:
+                last_error = e
+                if attempt < self.max_retries:
+                    delay = min(30, 2 ** attempt) * random.uniform(0.5, 1)
+                    print(f"Request to {model} failed ({type(e).__name__}). Retrying in {delay:.1f} seconds...")
+                    await asyncio.sleep(delay)
+        raise last_error
+
+    def get_latency_percentile(self, model, percentile):
+        """Latency (seconds) at the given percentile of recent successful requests, or None if too few samples."""
+        samples = self.latencies.get(model)
+        if not samples or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+    async def __post_chat_async(self, data, session):
+        """Send one chat request with its own deadline and record its latency."""
+        start = time.monotonic()
         async with session.post(
             "http://localhost:11434/api/chat",
             json=data,
-            timeout=aiohttp.ClientTimeout(total=120)
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout)
         ) as response:
             response_json = await response.json()
-            return response_json["message"]["content"]
+            content = response_json["message"]["content"]
+        self.latencies.setdefault(data["model"], deque(maxlen=200)).append(time.monotonic() - start)
+        return content
+
+    async def __send_hedged_async(self, data, session):
+        """
+        Send a request, and a duplicate if it's still running past the hedge latency.
+
+        Whichever finishes first successfully wins and the other is cancelled, so one
+        stuck generation can't hold up a whole batch.
+        """
+        hedge_delay = None
+        if self.hedge_percentile is not None:
+            hedge_delay = self.get_latency_percentile(data["model"], self.hedge_percentile)
+
+        primary = asyncio.create_task(self.__post_chat_async(data, session))
+        if hedge_delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        self.hedges_sent += 1
+        hedge = asyncio.create_task(self.__post_chat_async(data, session))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedges_won += 1
+                        return task.result()
+            # Both failed; surface the primary's error
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if not task.done():
+                    task.cancel()
     
     def __trim_chat_history(self):
         """
@@ -155,14 +255,15 @@ class OllamaAI:
     def stop(self):
         self.chat_history = []
         self.system_message = None
-        data = {
-            "model": self.model,
-            "messages": [],
-            "keep_alive": 0
-        }
-        response = requests.post(
-            "http://localhost:11434/api/chat", data=json.dumps(data)
-        )
+        for model in filter(None, (self.model, self.cascade_model)):
+            data = {
+                "model": model,
+                "messages": [],
+                "keep_alive": 0
+            }
+            response = requests.post(
+                "http://localhost:11434/api/chat", data=json.dumps(data)
+            )
         
             
         
@@ -0,0 +1,167 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+
+class RateLimitedError(Exception):
+    """Raised when a server tells us to slow down (HTTP 429 / "Retry later")."""
+
+    def __init__(self, url, retry_after=None):
+        super().__init__(f"Rate limited by {urlparse(url).netloc}")
+        self.url = url
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header value.
+
+    value: str - Either a number of seconds or an HTTP date.
+
+    Returns the number of seconds to wait, or None if the value can't be parsed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class _HostState:
+    def __init__(self, rate, burst, max_concurrency):
+        self.rate = rate
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.sync_slots = threading.Semaphore(max_concurrency)
+        self.async_slots = None
+        self.async_loop = None
+
+
+class RequestScheduler:
+    def __init__(self, rate: float = 1.0, burst: int = 2, max_concurrency_per_host: int = 2, jitter: float = 0.5,
+                 base_backoff: float = 5.0, max_backoff: float = 300.0, min_rate: float = 0.02, recovery_step: float = 0.05):
+        """
+        Initialize the RequestScheduler class.
+
+        Every host gets a token bucket that starts at full speed. Requests wait for a token
+        (plus a little jitter) and a free concurrency slot. When the server throttles us,
+        the host is paused for its Retry-After (or an exponential backoff) and its rate is
+        halved; each success then nudges the rate back up towards `rate`.
+
+        rate: float - Maximum requests per second per host.
+        burst: int - Number of requests that may be sent back-to-back before the rate applies.
+        max_concurrency_per_host: int - Maximum simultaneous requests to one host.
+        jitter: float - Maximum random delay (seconds) added before each request.
+        base_backoff: float - First backoff delay (seconds) after an error; doubles per attempt.
+        max_backoff: float - Upper limit for backoff and Retry-After delays.
+        min_rate: float - Lowest rate the scheduler will slow down to.
+        recovery_step: float - Requests per second regained after each successful request.
+        """
+        self.max_rate = rate
+        self.burst = burst
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.jitter = jitter
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.min_rate = min_rate
+        self.recovery_step = recovery_step
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def __get_host_state(self, url):
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = _HostState(self.max_rate, self.burst, self.max_concurrency_per_host)
+        return self.hosts[host]
+
+    def __get_wait(self, state, now, tokens_after):
+        """Time until a request may be sent, given the bucket level once its token is taken."""
+        wait = max(0.0, state.blocked_until - now)
+        if tokens_after < 0:
+            wait = max(wait, -tokens_after / state.rate)
+        return wait
+
+    def __reserve_token(self, url):
+        """Take a token from the host's bucket and return how long to wait before sending."""
+        with self.lock:
+            state = self.__get_host_state(url)
+            now = time.monotonic()
+            state.tokens = min(self.burst, state.tokens + (now - state.last_refill) * state.rate)
+            state.last_refill = now
+            state.tokens -= 1
+            wait = self.__get_wait(state, now, state.tokens)
+        return wait + random.uniform(0, self.jitter)
+
+    def __get_async_slots(self, url):
+        with self.lock:
+            state = self.__get_host_state(url)
+            loop = asyncio.get_running_loop()
+            # asyncio primitives are bound to one event loop, and callers use asyncio.run per batch
+            if state.async_loop is not loop:
+                state.async_slots = asyncio.Semaphore(self.max_concurrency_per_host)
+                state.async_loop = loop
+            return state.async_slots
+
+    @contextmanager
+    def request(self, url):
+        """Block until a request to `url` is allowed, holding a concurrency slot for its duration."""
+        with self.lock:
+            state = self.__get_host_state(url)
+        with state.sync_slots:
+            time.sleep(self.__reserve_token(url))
+            yield
+
+    @asynccontextmanager
+    async def request_async(self, url):
+        """Async version of request()."""
+        async with self.__get_async_slots(url):
+            await asyncio.sleep(self.__reserve_token(url))
+            yield
+
+    def get_backoff_delay(self, attempt):
+        """Exponential backoff with jitter for the given (0-based) retry attempt."""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    def record_success(self, url):
+        """Speed the host back up after a successful request."""
+        with self.lock:
+            state = self.__get_host_state(url)
+            state.rate = min(self.max_rate, state.rate + self.recovery_step)
+
+    def record_throttled(self, url, retry_after=None, attempt=0):
+        """
+        Slow down after the host told us to back off.
+
+        Pauses the host for `retry_after` seconds (or an exponential backoff if the server
+        didn't say) and halves its request rate.
+
+        Returns how long the next request to the host will actually wait (excluding jitter),
+        which can be longer than the pause because of the lowered rate.
+        """
+        delay = retry_after if retry_after is not None else self.get_backoff_delay(attempt)
+        delay = min(delay, self.max_backoff)
+        with self.lock:
+            state = self.__get_host_state(url)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+            state.rate = max(self.min_rate, state.rate / 2)
+            state.tokens = min(state.tokens, 0)
+
+            now = time.monotonic()
+            tokens_now = min(self.burst, state.tokens + (now - state.last_refill) * state.rate)
+            return self.__get_wait(state, now, tokens_now - 1)
+
+    def get_rate(self, url):
+        """Current request rate (requests per second) for the host of `url`."""
+        with self.lock:
+            return self.__get_host_state(url).rate
@@ -1,19 +1,37 @@
+import csv
+import gzip
+import json
 import math
+import mmap
+import os
 import random
+import sys
+import tarfile
+import tempfile
 import time
 import asyncio
 import aiohttp
+import numpy as np
+from scipy import sparse
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from bs4 import BeautifulSoup
 
 from OllamaAI import OllamaAI
+from ComparisonGraph import ComparisonGraph
+from RequestScheduler import RequestScheduler, RateLimitedError, parse_retry_after
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+# Shared by every request to AO3 so page scrapes and deep fetches respect one rate limit
+ao3_scheduler = RequestScheduler(rate=0.5, burst=2, max_concurrency_per_host=2)
+
 def get_user_input():
     """Get user input for scraping parameters."""
     url = input("Enter the AO3 URL with desired filters applied: ")
@@ -21,12 +39,27 @@ def get_user_input():
     search_param = input("Enter what type of works you are interested in, in natural language: ")
     return url, pages, search_param
 
-def fetch_page_with_selenium(url):
+# Resources the parser never looks at; blocking them makes each page load much lighter
+BLOCKED_RESOURCE_PATTERNS = [
+    '*.css', '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+]
+
+# Work blurbs, the "N Found" heading (present even with 0 results), or AO3's error/notice flash
+PAGE_READY_SELECTOR = "li.work.blurb, #main h3.heading, #main .flash"
+
+def fetch_page_with_selenium(url, fast_load=True, timings=None):
     """
     Fetch AO3 page content using Selenium.
     
+    In fast-load mode the page is returned as soon as the DOM is ready and the
+    work blurbs (or the results heading) are present, with images, stylesheets
+    and fonts blocked. Otherwise the whole page is loaded and given a fixed 3 s.
+    
     Args:
         url: The URL to fetch
+        fast_load: Use the eager, resource-blocking load (default: True)
+        timings: Optional list that a dict of this page's load timings is appended to
     
     Returns:
         HTML content as string, or None if it fails
@@ -45,21 +78,61 @@ def fetch_page_with_selenium(url):
         chrome_options.add_argument('--disable-dev-shm-usage')
         chrome_options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36')
         
+        if fast_load:
+            # Return from driver.get() at DOMContentLoaded instead of the full load event
+            chrome_options.page_load_strategy = 'eager'
+            chrome_options.add_experimental_option('prefs', {
+                'profile.managed_default_content_settings.images': 2,
+            })
+        
         print("Initializing Chrome browser...")
+        start_time = time.time()
         driver = webdriver.Chrome(options=chrome_options)
+        startup_time = time.time() - start_time
         
         try:
+            if fast_load:
+                driver.execute_cdp_cmd('Network.enable', {})
+                driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_RESOURCE_PATTERNS})
+            
             print(f"Navigating to: {url}")
+            nav_start = time.time()
             driver.get(url)
+            nav_time = time.time() - nav_start
             
             print("Waiting for page to load...")
-            WebDriverWait(driver, 15).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            time.sleep(3)
+            wait_start = time.time()
+            if fast_load:
+                try:
+                    WebDriverWait(driver, 15).until(EC.any_of(
+                        EC.presence_of_element_located((By.CSS_SELECTOR, PAGE_READY_SELECTOR)),
+                        EC.text_to_be_present_in_element((By.TAG_NAME, "body"), "Retry later"),
+                    ))
+                except TimeoutException:
+                    # Unfamiliar page layout; hand back whatever loaded and let the parser decide
+                    print("Expected page content not found, using page as loaded")
+            else:
+                WebDriverWait(driver, 15).until(
+                    EC.presence_of_element_located((By.TAG_NAME, "body"))
+                )
+                time.sleep(3)
+            wait_time = time.time() - wait_start
             
             html_content = driver.page_source
-            print(f"✓ Successfully fetched page ({len(html_content)} bytes)\n")
+            
+            timing = {
+                'url': url,
+                'startup': startup_time,
+                'navigation': nav_time,
+                'wait': wait_time,
+                'total': time.time() - start_time,
+            }
+            if timings is not None:
+                timings.append(timing)
+            
+            print(f"✓ Successfully fetched page ({len(html_content)} bytes)")
+            print(f"  Timings: browser start {startup_time:.2f}s | navigation {nav_time:.2f}s | "
+                  f"content wait {wait_time:.2f}s | total {timing['total']:.2f}s\n")
             print("="*80 + "\n")
             
             return html_content
@@ -114,12 +187,24 @@ def parse_ao3_html(html_content):
     fics = []
     
     for work in works:
+        work_id = work['id'].split('_', 1)[1]
+        
         # Extract title and URL
         title_tag = work.find('h4', class_='heading')
         title_link = title_tag.find('a') if title_tag else None
         title = title_link.get_text(strip=True) if title_link else 'N/A'
         url = f"https://archiveofourown.org{title_link['href']}" if title_link and title_link.get('href') else 'N/A'
         
+        # Extract authors (anonymous works have none)
+        authors = [author.get_text(strip=True) for author in title_tag.find_all('a', rel='author')] if title_tag else []
+        
+        # Extract the IDs of any series the work belongs to
+        series_list = work.find('ul', class_='series')
+        series = []
+        if series_list:
+            series = [link['href'].rstrip('/').rsplit('/', 1)[-1] for link in series_list.find_all('a', href=True)
+                      if '/series/' in link['href']]
+        
         # Extract fandoms
         fandom_heading = work.find('h5', class_='fandoms')
         fandoms = [fandom.get_text(strip=True) for fandom in fandom_heading.find_all('a', class_='tag')] if fandom_heading else []
@@ -184,8 +269,11 @@ def parse_ao3_html(html_content):
             kudos = extract_stat_value(stats, 'kudos')
         
         fic_info = {
+            'work_id': work_id,
             'title': title,
             'url': url,
+            'authors': authors,
+            'series': series,
             'fandoms': fandoms,
             'rating': rating,
             'warnings': warnings,
@@ -206,114 +294,677 @@ def parse_ao3_html(html_content):
     
     return fics
 
-def scrape_ao3_page(base_url):
+def scrape_ao3_page(base_url, fast_load=True, timings=None):
     """
     Scrape an AO3 page using Selenium.
     
     Args:
         base_url: URL to scrape
+        fast_load: Use the eager, resource-blocking page load (default: True)
+        timings: Optional list that the page's load timings are appended to
     
     Returns:
         List of fic dictionaries
+    
+    Raises:
+        RateLimitedError: If AO3 served its "Retry later" page instead of results
     """
-    html_content = fetch_page_with_selenium(base_url)
+    with ao3_scheduler.request(base_url):
+        html_content = fetch_page_with_selenium(base_url, fast_load=fast_load, timings=timings)
     
     if html_content is None:
         print("Failed to fetch page. Skipping...\n")
         return []
     
-    return parse_ao3_html(html_content)
+    fics = parse_ao3_html(html_content)
+    # Selenium can't see the status code, so detect AO3's 429 page by its text
+    if not fics and "Retry later" in html_content:
+        raise RateLimitedError(base_url)
+    
+    ao3_scheduler.record_success(base_url)
+    return fics
 
 
-def scrape_multiple_pages(url, pages):
+def scrape_multiple_pages(url, pages, fast_load=True):
     """
     Scrape multiple pages of AO3 search results.
     
     Args:
         url: Base URL with search filters applied
         pages: Number of pages to scrape
+        fast_load: Use the eager, resource-blocking page load (default: True)
     
     Returns:
         List of all fic dictionaries from all pages
     """
     fics = []
+    page_load_timings = []
     max_page_retries = 2
+    max_rate_limit_retries = 4
     
+    # Pacing between pages is handled by ao3_scheduler
     for page_num in range(pages):
         current_url = f"{url}&page={page_num + 1}"
         print(f"Scraping page {page_num + 1}...")
         
         fics_on_page = []
-        for retry_count in range(max_page_retries):
+        attempts = 0
+        rate_limited_count = 0
+        while True:
             try:
-                fics_on_page = scrape_ao3_page(current_url)
+                fics_on_page = scrape_ao3_page(current_url, fast_load=fast_load, timings=page_load_timings)
+                attempts += 1
                 
-                if len(fics_on_page) == 0 and retry_count < max_page_retries - 1:
-                    print("No works found. Retrying in 10 seconds...")
-                    time.sleep(10)
+                if len(fics_on_page) == 0 and attempts < max_page_retries:
+                    wait_time = ao3_scheduler.get_backoff_delay(attempts - 1)
+                    print(f"No works found. Retrying in {wait_time:.1f} seconds...")
+                    time.sleep(wait_time)
                 else:
                     break
+            except RateLimitedError:
+                rate_limited_count += 1
+                # Always slow the scheduler down, even when giving up, so the next page waits too
+                wait_time = ao3_scheduler.record_throttled(current_url, attempt=rate_limited_count - 1)
+                if rate_limited_count >= max_rate_limit_retries:
+                    print(f"Still rate limited after {max_rate_limit_retries} attempts. Skipping page {page_num + 1}...")
+                    break
+                # The scheduler holds back the next request, so no sleep is needed here
+                print(f"Rate limited by AO3. Slowing down and retrying in {wait_time:.1f} seconds...")
             except Exception as e:
+                attempts += 1
                 print(f"Error scraping page: {str(e)}")
-                if retry_count < max_page_retries - 1:
-                    wait_time = (retry_count + 1) * 15
-                    print(f"Retrying in {wait_time} seconds...")
+                if attempts < max_page_retries:
+                    wait_time = ao3_scheduler.get_backoff_delay(attempts - 1)
+                    print(f"Retrying in {wait_time:.1f} seconds...")
                     time.sleep(wait_time)
                 else:
                     print(f"Failed to scrape page {page_num + 1} after {max_page_retries} attempts. Skipping...")
+                    break
         
         fics.extend(fics_on_page)
-        
-        # # Rate limiting between pages
-        # if page_num < pages - 1:
-        #     wait_time = random.uniform(8, 15)
-        #     print(f"Waiting {wait_time:.1f} seconds before next page...")
-        #     time.sleep(wait_time)
     
     print(f"\n{'='*80}")
     print(f"Successfully scraped {len(fics)} works from {pages} page(s)")
+    if page_load_timings:
+        average_total = sum(t['total'] for t in page_load_timings) / len(page_load_timings)
+        average_nav = sum(t['navigation'] for t in page_load_timings) / len(page_load_timings)
+        print(f"Average page load: {average_total:.2f}s ({average_nav:.2f}s navigation)")
+    print(f"{'='*80}\n")
+    
+    return fics
+
+MMAP_THRESHOLD_BYTES = 1_000_000
+
+
+def read_saved_page(path):
+    """
+    Read a saved HTML page, memory-mapping it if it's large.
+    
+    Args:
+        path: Path to the HTML file
+    
+    Returns:
+        HTML content as string
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size >= MMAP_THRESHOLD_BYTES:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Decode straight from the mapping; slicing it would copy the whole file into a bytes object first
+                return str(mapped, 'utf-8', 'ignore')
+        return f.read().decode('utf-8', errors='ignore')
+
+
+def parse_saved_page(path):
+    """
+    Parse one saved AO3 results page. Runs inside a worker process.
+    
+    Returns:
+        Tuple of (path, list of fic dictionaries); the list is empty if parsing fails
+    """
+    try:
+        return path, parse_ao3_html(read_saved_page(path))
+    except Exception as e:
+        print(f"Error parsing {path}: {str(e)}")
+        return path, []
+
+
+def find_saved_pages(directory):
+    """Find all saved HTML pages under a directory, sorted by path."""
+    pages = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.lower().endswith(('.html', '.htm')):
+                pages.append(os.path.join(root, filename))
+    return sorted(pages)
+
+
+def iter_imported_fics(path, max_workers=None):
+    """
+    Parse saved AO3 result pages in parallel, yielding fics as each page finishes.
+    
+    Pages are parsed in a process pool, so large imports use every core.
+    
+    Args:
+        path: Directory of .html files, or a tarball (.tar, .tar.gz, ...) of them
+        max_workers: Number of worker processes (default: one per core)
+    
+    Yields:
+        Fic dictionaries, in page completion order
+    """
+    with tempfile.TemporaryDirectory() as extract_dir:
+        if os.path.isfile(path) and tarfile.is_tarfile(path):
+            print(f"Extracting {path}...")
+            with tarfile.open(path) as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(extract_dir, filter='data')
+                else:
+                    tar.extractall(extract_dir)
+            directory = extract_dir
+        elif os.path.isdir(path):
+            directory = path
+        else:
+            raise ValueError(f"{path} is not a directory or tarball")
+        
+        page_paths = find_saved_pages(directory)
+        print(f"Parsing {len(page_paths)} saved pages with {max_workers or os.cpu_count()} processes...")
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(parse_saved_page, page_path) for page_path in page_paths]
+            for page_num, future in enumerate(as_completed(futures), 1):
+                page_path, fics_on_page = future.result()
+                if page_num % 50 == 0 or page_num == len(page_paths):
+                    print(f"Parsed {page_num}/{len(page_paths)} pages")
+                yield from fics_on_page
+
+
+def import_saved_pages(path, max_workers=None):
+    """
+    Import fics from saved AO3 search-result pages instead of scraping.
+    
+    Works that appear on more than one page are only kept once.
+    
+    Args:
+        path: Directory of .html files, or a tarball of them
+        max_workers: Number of worker processes (default: one per core)
+    
+    Returns:
+        List of unique fic dictionaries
+    """
+    fics = []
+    seen_work_ids = set()
+    
+    for fic in iter_imported_fics(path, max_workers):
+        if fic['work_id'] in seen_work_ids:
+            continue
+        seen_work_ids.add(fic['work_id'])
+        fics.append(fic)
+    
+    print(f"\n{'='*80}")
+    print(f"Successfully imported {len(fics)} unique works from {path}")
     print(f"{'='*80}\n")
     
     return fics
 
-async def score_fic_batch_async(fics_batch, search_param, ai, batch_num, total_batches):
-    """Score a batch of fics concurrently."""
+
+def get_work_cache_path(fic, cache_dir):
+    """
+    Get the on-disk cache path for a fic's chapter 1 text.
+    
+    Keyed by work id and chapter count, so a work that gains chapters is re-fetched.
+    """
+    chapters = fic.get('chapters', 'N/A').replace('/', '-').replace('?', 'x')
+    return os.path.join(cache_dir, f"{fic['work_id']}_{chapters}.txt.gz")
+
+
+def truncate_to_token_budget(text, token_budget, chars_per_token=4):
+    """
+    Truncate text to roughly `token_budget` tokens, cutting at a word boundary.
+    
+    Uses a characters-per-token estimate rather than a tokenizer, which is close
+    enough for English prose and avoids loading the model's tokenizer.
+    """
+    max_chars = token_budget * chars_per_token
+    if len(text) <= max_chars:
+        return text
+    truncated = text[:max_chars]
+    last_space = truncated.rfind(' ')
+    if last_space > max_chars // 2:
+        truncated = truncated[:last_space]
+    return truncated + " [...]"
+
+
+async def fetch_work_opening_async(fic, session, max_bytes=400_000, max_attempts=3):
+    """
+    Download the opening of chapter 1 for a single fic.
+    
+    The response is streamed and reading stops once `max_bytes` have arrived, so
+    long single-page works aren't downloaded in full. Requests go through
+    ao3_scheduler, which caps concurrency and honours Retry-After on HTTP 429.
+    
+    Args:
+        fic: Fic dictionary with a 'work_id'
+        session: aiohttp ClientSession
+        max_bytes: Maximum number of HTML bytes to read
+        max_attempts: Maximum number of attempts when rate limited or on errors
+    
+    Returns:
+        Chapter 1 text (possibly cut short by `max_bytes`), or None if it fails
+    """
+    url = f"https://archiveofourown.org/works/{fic['work_id']}?view_adult=true"
+    chunks = None
+    
+    for attempt in range(max_attempts):
+        try:
+            async with ao3_scheduler.request_async(url):
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=60)) as response:
+                    if response.status in (429, 503):
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        wait_time = ao3_scheduler.record_throttled(url, retry_after, attempt)
+                        if attempt < max_attempts - 1:
+                            print(f"Rate limited fetching '{fic['title']}'. Retrying in {wait_time:.1f} seconds...")
+                        continue
+                    if response.status != 200:
+                        print(f"Failed to fetch '{fic['title']}' (HTTP {response.status})")
+                        return None
+                    
+                    chunks = []
+                    received = 0
+                    async for chunk in response.content.iter_chunked(16384):
+                        chunks.append(chunk)
+                        received += len(chunk)
+                        if received >= max_bytes:
+                            break
+                    ao3_scheduler.record_success(url)
+                    break
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Error fetching '{fic['title']}': {str(e)}")
+            if attempt < max_attempts - 1:
+                await asyncio.sleep(ao3_scheduler.get_backoff_delay(attempt))
+    
+    if chunks is None:
+        print(f"Failed to fetch '{fic['title']}' after {max_attempts} attempts. Skipping...")
+        return None
+    
+    html_content = b''.join(chunks).decode('utf-8', errors='ignore')
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # The chapter body is the userstuff div that isn't a summary/notes blockquote
+    body = soup.find('div', class_='userstuff', role='article') or soup.find('div', class_='userstuff')
+    if body is None:
+        return None
+    
+    text = body.get_text(separator=' ', strip=True)
+    if text.startswith('Chapter Text'):
+        text = text[len('Chapter Text'):].lstrip()
+    return text
+
+
+async def deep_fetch_fics_async(fics):
+    """Fetch chapter 1 openings for fics not already in the cache."""
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/142.0.0.0 Safari/537.36'}
+    async with aiohttp.ClientSession(headers=headers) as session:
+        tasks = [fetch_work_opening_async(fic, session) for fic in fics]
+        return await asyncio.gather(*tasks)
+
+
+def deep_fetch_fics(fics, cache_dir="work_cache", token_budget=1500):
+    """
+    Attach the opening of chapter 1 to each fic as 'opening_text'.
+    
+    Text is cached gzip-compressed on disk, so re-ranking the same works costs no requests.
+    
+    Args:
+        fics: List of fic dictionaries (normally just the shortlisted top few)
+        cache_dir: Directory for the compressed work text cache
+        token_budget: Approximate token limit for each fic's opening text
+    
+    Returns:
+        The same list of fics, with 'opening_text' set where fetching succeeded
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    to_fetch = []
+    
+    for fic in fics:
+        if not fic.get('work_id'):
+            continue
+        cache_path = get_work_cache_path(fic, cache_dir)
+        if os.path.exists(cache_path):
+            try:
+                with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+                    fic['opening_text'] = truncate_to_token_budget(f.read(), token_budget)
+                continue
+            except (OSError, EOFError):
+                # e.g. truncated by a run interrupted before writes were atomic; treat as a cache miss
+                print(f"Cached text for '{fic['title']}' is unreadable. Re-fetching...")
+        to_fetch.append(fic)
+    
+    print(f"Deep fetching {len(to_fetch)} works ({len(fics) - len(to_fetch)} cached)...")
+    
+    if to_fetch:
+        texts = asyncio.run(deep_fetch_fics_async(to_fetch))
+        for fic, text in zip(to_fetch, texts):
+            if text is None:
+                continue
+            # Cache the untruncated text so a larger budget later doesn't need a re-fetch
+            compressed = gzip.compress(text.encode('utf-8'))
+            write_file_atomically(get_work_cache_path(fic, cache_dir), lambda f: f.write(compressed), binary=True)
+            fic['opening_text'] = truncate_to_token_budget(text, token_budget)
+    
+    return fics
+
+TAG_FIELDS = ['fandoms', 'relationships', 'characters', 'freeform_tags']
+TITLE_STEM_WORDS = {'part', 'chapter', 'book', 'vol', 'volume', 'the', 'a', 'an'}
+
+
+def build_tag_matrix(fics):
+    """
+    Build a sparse one-hot matrix of each fic's tags.
+    
+    Tags are prefixed with their field, so a character and a freeform tag with the
+    same text count as different features.
+    
+    Args:
+        fics: List of fic dictionaries
+    
+    Returns:
+        Tuple of (N x V float32 CSR matrix, list of the V tag names)
+    """
+    vocabulary = {}
+    row_indices = []
+    col_indices = []
+    for i, fic in enumerate(fics):
+        row = set()
+        for field in TAG_FIELDS:
+            for tag in fic.get(field, []):
+                row.add(vocabulary.setdefault(f"{field}:{tag.lower()}", len(vocabulary)))
+        row_indices.extend([i] * len(row))
+        col_indices.extend(row)
+    
+    data = np.ones(len(col_indices), dtype=np.float32)
+    matrix = sparse.csr_matrix((data, (row_indices, col_indices)), shape=(len(fics), len(vocabulary)))
+    
+    tag_names = sorted(vocabulary, key=vocabulary.get)
+    return matrix, tag_names
+
+
+def find_similar_pairs(matrix, threshold, block_size=256):
+    """
+    Find every pair of rows with a Jaccard similarity of at least `threshold`.
+    
+    Similarities are computed a block of rows at a time and only the pairs above the
+    threshold are kept, so memory stays proportional to the number of matches rather
+    than N x N.
+    
+    Args:
+        matrix: N x V sparse one-hot matrix, from build_tag_matrix
+        threshold: Minimum Jaccard similarity to keep
+        block_size: Number of rows to compare against all others at once
+    
+    Returns:
+        Tuple of (row indices, column indices, similarities), with each pair listed once (row < column)
+    """
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    transposed = matrix.T.tocsr()
+    found_rows, found_cols, found_similarities = [], [], []
+    
+    for block_start in range(0, matrix.shape[0], block_size):
+        intersection = (matrix[block_start:block_start + block_size] @ transposed).tocoo()
+        rows = intersection.row + block_start
+        cols = intersection.col
+        upper = cols > rows
+        rows, cols, shared = rows[upper], cols[upper], intersection.data[upper]
+        
+        similarity = shared / (sizes[rows] + sizes[cols] - shared)
+        keep = similarity >= threshold
+        found_rows.append(rows[keep])
+        found_cols.append(cols[keep])
+        found_similarities.append(similarity[keep])
+    
+    if not found_rows:
+        return np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=np.float32)
+    return np.concatenate(found_rows), np.concatenate(found_cols), np.concatenate(found_similarities)
+
+
+def get_title_stem(title):
+    """
+    Normalise a title so the parts of a series compare equal.
+    
+    e.g. "Falling (Part 2)" and "Falling, Part 3" both become "falling".
+    """
+    words = ''.join(c if c.isalpha() else ' ' for c in title.lower()).split()
+    return ' '.join(word for word in words if word not in TITLE_STEM_WORDS)
+
+
+def share_origin(fic1, fic2):
+    """Whether two fics share an author, a series or a title stem."""
+    if set(fic1.get('authors', [])) & set(fic2.get('authors', [])):
+        return True
+    if set(fic1.get('series', [])) & set(fic2.get('series', [])):
+        return True
+    stem = get_title_stem(fic1['title'])
+    return bool(stem) and stem == get_title_stem(fic2['title'])
+
+
+def cluster_near_duplicates(fics, threshold=0.8, min_tags=5):
+    """
+    Group near-duplicate fics (series parts, reposts, etc.).
+    
+    Two fics are near-duplicates when their tags have a Jaccard similarity of at least
+    `threshold` and they also share an author, a series or a title stem. Fics with
+    fewer than `min_tags` non-fandom tags are never clustered, since a handful of
+    common tags says little about the fic.
+    
+    Fics are visited from most to least kudosed. Each one joins the most similar
+    existing representative it matches, or starts its own cluster, so every member is
+    a near-duplicate of its representative rather than only of another member.
+    
+    Args:
+        fics: List of fic dictionaries
+        threshold: Minimum Jaccard similarity to count as a near-duplicate
+        min_tags: Minimum number of relationship, character and freeform tags a fic needs to be clustered
+    
+    Returns:
+        Tuple of (list of representative fics, dict of representative work_id -> other members)
+    """
+    # The same work can show up on two result pages if AO3's ordering shifts mid-scrape
+    unique_fics = {}
+    for fic in fics:
+        unique_fics.setdefault(fic['work_id'], fic)
+    fics = list(unique_fics.values())
+    
+    candidates = [fic for fic in fics
+                  if len(fic['relationships']) + len(fic['characters']) + len(fic['freeform_tags']) >= min_tags]
+    if len(candidates) < 2:
+        return fics, {}
+    
+    rows, cols, similarities = find_similar_pairs(build_tag_matrix(candidates)[0], threshold)
+    neighbours = {}
+    for i, j, similarity in zip(rows.tolist(), cols.tolist(), similarities.tolist()):
+        if share_origin(candidates[i], candidates[j]):
+            neighbours.setdefault(i, []).append((similarity, j))
+            neighbours.setdefault(j, []).append((similarity, i))
+    
+    # Leader clustering: most-kudosed fics become representatives first
+    representative_of = {}
+    for i in sorted(neighbours, key=lambda idx: candidates[idx]['kudos'], reverse=True):
+        matches = [(similarity, j) for similarity, j in neighbours[i] if representative_of.get(j) == j]
+        representative_of[i] = max(matches)[1] if matches else i
+    
+    clusters = {}
+    duplicate_ids = set()
+    for i in sorted(representative_of, key=lambda idx: candidates[idx]['kudos'], reverse=True):
+        representative = representative_of[i]
+        if representative != i:
+            clusters.setdefault(candidates[representative]['work_id'], []).append(candidates[i])
+            duplicate_ids.add(candidates[i]['work_id'])
+    
+    # Keep the original (shuffled) order for the ranking stage
+    representatives = [fic for fic in fics if fic['work_id'] not in duplicate_ids]
+    
+    print(f"Clustered {len(fics)} fics into {len(representatives)} groups ({len(duplicate_ids)} near-duplicates skipped for ranking)")
+    return representatives, clusters
+
+
+def get_cluster_group(fic, clusters):
+    """
+    Get a representative followed by its clustered near-duplicates.
+    
+    Members are marked with the representative's work_id and inherit its LLM scores.
+    """
+    members = (clusters or {}).get(fic['work_id'], [])
+    for member in members:
+        member['duplicate_of'] = fic['work_id']
+        for field in ('llm_rank', 'cascade_rank'):
+            if field in fic:
+                member[field] = fic[field]
+    return [fic] + members
+
+
+def expand_clusters(ordered_fics, clusters):
+    """
+    Re-insert clustered near-duplicates directly after their ranked representative.
+    
+    Members inherit the representative's LLM score. Tournament ranks are renumbered
+    over the expanded list, but only for the leading run of representatives that the
+    tournament actually placed; everything after it is left unranked.
+    
+    Args:
+        ordered_fics: Ranked list of representative fics (best to worst)
+        clusters: Dict of representative work_id -> other members, from cluster_near_duplicates
+    
+    Returns:
+        Ranked list including every cluster member
+    """
+    expanded = []
+    in_ranked_prefix = True
+    for fic in ordered_fics:
+        in_ranked_prefix = in_ranked_prefix and 'tournament_rank' in fic
+        for grouped_fic in get_cluster_group(fic, clusters):
+            expanded.append(grouped_fic)
+            if in_ranked_prefix:
+                grouped_fic['tournament_rank'] = len(expanded)
+            else:
+                grouped_fic.pop('tournament_rank', None)
+    
+    return expanded
+
+
+def format_fic_for_prompt(fic):
+    """
+    Format the fic fields the LLM ranks on as a prompt block.
+    
+    Includes the opening of chapter 1 when it has been deep-fetched.
+    """
+    fic_summary = (
+        f"Title: {fic['title']}\n"
+        f"Fandoms: {', '.join(fic['fandoms'])}\n"
+        f"Warnings: {fic['warnings']}\n"
+        f"Warnings Tags: {', '.join(fic['warnings_tags'])}\n"
+        f"Relationships: {', '.join(fic['relationships'])}\n"
+        f"Characters: {', '.join(fic['characters'])}\n"
+        f"Tags: {', '.join(fic['freeform_tags'])}\n"
+        f"Summary: {fic['summary']}\n"
+        f"Word Count: {fic['word_count']}\n"
+    )
+    if fic.get('opening_text'):
+        fic_summary += f"Opening of Chapter 1: {fic['opening_text']}\n"
+    return fic_summary
+
+async def score_fic_batch_async(fics_batch, search_param, ai, batch_num, total_batches, escalate=False):
+    """
+    Score a batch of fics concurrently.
+    
+    If `escalate` is set, the cascade model scores them instead and its score is
+    stored as 'cascade_rank', leaving the screening 'llm_rank' untouched.
+    """
     async with aiohttp.ClientSession() as session:
         tasks = []
         for fic in fics_batch:
             
-            fic_summary = (
-                f"Title: {fic['title']}\n"
-                f"Fandoms: {', '.join(fic['fandoms'])}\n"
-                f"Warnings: {fic['warnings']}\n"
-                f"Warnings Tags: {', '.join(fic['warnings_tags'])}\n"
-                f"Relationships: {', '.join(fic['relationships'])}\n"
-                f"Characters: {', '.join(fic['characters'])}\n"
-                f"Tags: {', '.join(fic['freeform_tags'])}\n"
-                f"Summary: {fic['summary']}\n"
-                f"Word Count: {fic['word_count']}\n"
-            )
+            fic_summary = format_fic_for_prompt(fic)
             prompt = f"fic info:\n{fic_summary}\n\nUSER SEARCH PARAMETER: {search_param}"
-            tasks.append(ai.send_message_async(prompt, session))
+            tasks.append(ai.send_message_async(prompt, session, escalate=escalate))
         
         print(f"Processing batch {batch_num}/{total_batches} ({len(fics_batch)} fics)...")
-        responses = await asyncio.gather(*tasks)
+        # A request that fails after its retries shouldn't take the rest of the batch down with it
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
         
         for fic, response in zip(fics_batch, responses):
+            if isinstance(response, Exception):
+                if escalate:
+                    print(f"Warning: Re-scoring failed for '{fic['title']}' ({type(response).__name__}). Keeping its screening position.")
+                    continue
+                print(f"Warning: Scoring failed for '{fic['title']}' ({type(response).__name__}). Using default rank of 15.")
+                fic['llm_rank'] = 15
+                continue
+            
             try:
                 word_count_rank = int(response.split("<Word Count: ")[1].split(">")[0])
                 relationship_rank = int(response.split("<Relationship: ")[1].split(">")[0])
                 overall_relevance_rank = int(response.split("<Overall Relevance: ")[1].split(">")[0])
                 fic_ranking = word_count_rank + relationship_rank + overall_relevance_rank
             except (IndexError, ValueError):
+                if escalate:
+                    print(f"Warning: Failed to parse re-score for '{fic['title']}'. Keeping its screening position.")
+                    continue
                 fic_ranking = 15
                 print(f"Warning: Failed to parse ranking for '{fic['title']}'. Using default rank of 15.")
             
-            fic['llm_rank'] = fic_ranking
+            fic['cascade_rank' if escalate else 'llm_rank'] = fic_ranking
         
         return fics_batch
 
-def rank_fics_with_scoring(fics, search_param, batch_size=10):
+def rescore_boundary_fics(fics, search_param, ai, batch_size, top_k, margin):
+    """
+    Re-score the fics closest to the top-K cut-off with the cascade model.
+    
+    Fics far above or below the cut-off keep their cheap screening score; only
+    those within `margin` points of it are re-scored, closest first, until the
+    cascade budget runs out. The new scores are stored as 'cascade_rank' and are
+    only compared with each other (see order_by_cascade_scores), since the two
+    models needn't score on the same scale.
+    
+    Args:
+        fics: List of scored fic dictionaries
+        search_param: User's search criteria
+        ai: OllamaAI instance with a cascade model
+        batch_size: Number of fics to score concurrently
+        top_k: Size of the shortlist whose boundary matters
+        margin: Maximum score distance from the boundary to re-score
+    """
+    scored_fics = sorted((fic for fic in fics if 'llm_rank' in fic), reverse=True, key=lambda x: x['llm_rank'])
+    if len(scored_fics) <= top_k:
+        return
+    
+    boundary_score = scored_fics[top_k - 1]['llm_rank']
+    close_calls = [fic for fic in scored_fics if abs(fic['llm_rank'] - boundary_score) <= margin]
+    close_calls.sort(key=lambda x: abs(x['llm_rank'] - boundary_score))
+    close_calls = close_calls[:ai.cascade_budget - ai.cascade_calls]
+    if not close_calls:
+        return
+    
+    print(f"\nRe-scoring {len(close_calls)} close calls near the top-{top_k} cut-off with {ai.cascade_model}...")
+    batches = [close_calls[i:i + batch_size] for i in range(0, len(close_calls), batch_size)]
+    for batch_num, batch in enumerate(batches, 1):
+        asyncio.run(score_fic_batch_async(batch, search_param, ai, batch_num, len(batches), escalate=True))
+
+def order_by_cascade_scores(ordered_fics):
+    """
+    Reorder the re-scored boundary fics among themselves by their cascade score.
+    
+    The re-scored fics keep the positions they held in the screening order, so a
+    model that scores higher or lower overall can't move them past other fics.
+    """
+    positions = [idx for idx, fic in enumerate(ordered_fics) if 'cascade_rank' in fic]
+    window = sorted((ordered_fics[idx] for idx in positions), reverse=True,
+                    key=lambda x: (x['cascade_rank'], x['llm_rank']))
+    result = list(ordered_fics)
+    for idx, fic in zip(positions, window):
+        result[idx] = fic
+    return result
+
+def rank_fics_with_scoring(fics, search_param, batch_size=10, writer=None, cascade_model=None, cascade_budget=20,
+                           cascade_top_k=10, cascade_margin=3, clusters=None):
     """
     Rank fics using LLM scoring system with batch processing for speed.
     
@@ -321,20 +972,38 @@ def rank_fics_with_scoring(fics, search_param, batch_size=10):
         fics: List of fic dictionaries to rank
         search_param: User's search criteria
         batch_size: Number of fics to score concurrently (default: 10)
+        writer: Optional ProgressiveOutputWriter, updated with a provisional ordering after every batch
+        cascade_model: Optional larger model that re-scores fics close to the top-K cut-off
+        cascade_budget: Maximum number of fics the cascade model may score
+        cascade_top_k: Size of the shortlist whose cut-off the cascade model refines
+        cascade_margin: Maximum score distance from the cut-off to count as a close call
+        clusters: Optional near-duplicate clusters from cluster_near_duplicates, shown behind
+            their representative in the provisional output
     
     Returns:
         List of fics sorted by LLM score (highest to lowest)
     """
-    ai = OllamaAI(ai_model, 2, max_history_pairs=0)
+    ai = OllamaAI(ai_model, 2, max_history_pairs=0, cascade_model=cascade_model, cascade_budget=cascade_budget)
     print(f"Scoring {len(fics)} fics in batches of {batch_size}...")
     print("(Press Ctrl+C to stop ranking and continue with ranked fics only)")
     
     batches = [fics[i:i + batch_size] for i in range(0, len(fics), batch_size)]
     total_batches = len(batches)
     
+    if writer:
+        writer.start(sum(1 + len((clusters or {}).get(fic['work_id'], [])) for fic in fics))
+    
     try:
         for batch_num, batch in enumerate(batches, 1):
             asyncio.run(score_fic_batch_async(batch, search_param, ai, batch_num, total_batches))
+            if writer:
+                scored_so_far = [fic for fic in fics if 'llm_rank' in fic]
+                scored_so_far.sort(reverse=True, key=lambda x: x['llm_rank'])
+                writer.write_snapshot(expand_clusters(scored_so_far, clusters))
+        
+        if ai.cascade_model:
+            rescore_boundary_fics(fics, search_param, ai, batch_size, cascade_top_k, cascade_margin)
+            print(f"Cascade model scored {ai.cascade_calls}/{ai.cascade_budget} budgeted fics")
     except KeyboardInterrupt:
         print(f"\n\n{'='*80}")
         ranked_count = sum(1 for fic in fics if 'llm_rank' in fic)
@@ -342,15 +1011,245 @@ def rank_fics_with_scoring(fics, search_param, batch_size=10):
         print(f"{'='*80}\n")
     
     ranked_fics = [fic for fic in fics if 'llm_rank' in fic]
-    ordered_fics = sorted(ranked_fics, reverse=True, key=lambda x: x['llm_rank'])
+    ordered_fics = order_by_cascade_scores(sorted(ranked_fics, reverse=True, key=lambda x: x['llm_rank']))
     
     print(f"\n{'='*80}")
     print(f"Fics sorted by LLM ranking ({len(ordered_fics)} fics):")
     for fic in ordered_fics:
-        print(f"Title: {fic['title']}, LLM Rank: {fic['llm_rank']}")
+        cascade_note = f", Cascade Rank: {fic['cascade_rank']}" if 'cascade_rank' in fic else ""
+        print(f"Title: {fic['title']}, LLM Rank: {fic['llm_rank']}{cascade_note}")
     
     return ordered_fics
 
+OUTPUT_FIELDS = [
+    'work_id', 'title', 'url', 'authors', 'series', 'fandoms', 'rating', 'warnings', 'category', 'is_complete',
+    'warnings_tags', 'relationships', 'characters', 'freeform_tags', 'summary',
+    'word_count', 'chapters', 'chapters_complete', 'comments', 'kudos',
+    'tournament_rank', 'llm_rank', 'cascade_rank', 'duplicate_of',
+]
+
+
+def format_fic_markdown(fic, idx):
+    """
+    Format a single fic as a markdown section.
+    
+    Args:
+        fic: Fic dictionary
+        idx: Position of the fic in the output (1-based)
+    
+    Returns:
+        Markdown string for the fic
+    """
+    lines = [f"## {idx}. [{fic['title']}]({fic['url']})\n\n"]
+    
+    if fic.get('authors'):
+        lines.append(f"**Author:** {', '.join(fic['authors'])}  \n\n")
+    
+    if 'tournament_rank' in fic:
+        lines.append(f"**Tournament Rank:** {fic['tournament_rank']}\n\n")
+    
+    if 'llm_rank' in fic:
+        lines.append(f"**LLM Rank:** {fic['llm_rank']}\n\n")
+    
+    if 'cascade_rank' in fic:
+        lines.append(f"**Cascade Rank:** {fic['cascade_rank']} (re-scored near the cut-off)\n\n")
+    
+    if 'duplicate_of' in fic:
+        lines.append(f"**Near-duplicate of:** [work {fic['duplicate_of']}](https://archiveofourown.org/works/{fic['duplicate_of']}) (ranked together)\n\n")
+    
+    lines.append(f"**Rating:** {fic['rating']}  \n")
+    lines.append(f"**Category:** {fic['category']}  \n")
+    lines.append(f"**Status:** {'Complete' if fic['is_complete'] else 'In Progress'}  \n")
+    lines.append(f"**Chapters:** {fic['chapters']}  \n")
+    lines.append(f"**Word Count:** {fic['word_count']:,}  \n\n")
+    
+    if fic['fandoms']:
+        lines.append(f"**Fandoms:** {' '.join(f'`{fandom}`' for fandom in fic['fandoms'])}  \n\n")
+    
+    if fic['warnings'] != 'N/A':
+        lines.append(f"**Warnings:** {fic['warnings']}  \n\n")
+    
+    if fic['relationships']:
+        lines.append(f"**Relationships:** {' '.join(f'`{rel}`' for rel in fic['relationships'])}  \n\n")
+    
+    if fic['characters']:
+        lines.append(f"**Characters:** {' '.join(f'`{char}`' for char in fic['characters'])}  \n\n")
+    
+    if fic['freeform_tags']:
+        lines.append(f"**Tags:** {' '.join(f'`{tag}`' for tag in fic['freeform_tags'])}  \n\n")
+    
+    if fic['summary'] != 'N/A':
+        lines.append("**Summary:**\n\n")
+        lines.append(f"> {fic['summary']}\n\n")
+    
+    lines.append(f"**Stats:** {fic['kudos']} kudos | {fic['comments']} comments  \n\n")
+    lines.append("---\n\n")
+    return ''.join(lines)
+
+
+def format_markdown_header(total, ranked=None):
+    """Format the markdown header, noting progress while ranking is still running."""
+    header = "# Filtered AO3 Fics\n\n"
+    header += f"**Total fics:** {total}\n\n"
+    if ranked is not None and ranked < total:
+        header += f"**Ranked so far:** {ranked} of {total} (ranking in progress)\n\n"
+    header += "---\n\n"
+    return header
+
+
+def fic_to_csv_row(fic, position):
+    """Flatten a fic dictionary into a CSV row, joining list fields."""
+    row = {'position': position}
+    for field in OUTPUT_FIELDS:
+        value = fic.get(field, '')
+        row[field] = ', '.join(value) if isinstance(value, list) else value
+    return row
+
+
+def fic_to_json_line(fic, position):
+    """Serialise a fic dictionary as a single JSONL record."""
+    record = {'position': position}
+    record.update({field: fic[field] for field in OUTPUT_FIELDS if field in fic})
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def write_file_atomically(filename, write_content, binary=False):
+    """
+    Write a file via a temporary sibling and swap it into place.
+    
+    Readers never see a half-written file, even if the run is interrupted mid-write.
+    
+    Args:
+        filename: Destination path
+        write_content: Callable taking an open file and writing the content
+        binary: Open the file in binary mode instead of UTF-8 text mode
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(filename))
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8', newline='')) as f:
+            write_content(f)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ProgressiveOutputWriter:
+    """
+    Write ranked fics to markdown, JSONL and CSV as their positions become final.
+    
+    The markdown file is rewritten atomically on every update so it can be opened
+    at any point during a long run. JSONL and CSV rows are appended as soon as a
+    fic settles, so downstream tools can tail them.
+    """
+    
+    def __init__(self, filename="filtered_fics.md", formats=("md", "jsonl", "csv")):
+        """
+        Args:
+            filename: Markdown output filename; JSONL/CSV files share its base name
+            formats: Output formats to write, any of "md", "jsonl" and "csv"
+        """
+        base = os.path.splitext(filename)[0]
+        self.formats = set(formats)
+        self.md_path = filename
+        self.jsonl_path = f"{base}.jsonl"
+        self.csv_path = f"{base}.csv"
+        self.total = 0
+        self.settled_count = 0
+        self.md_entries = []
+        self.first_result_time = None
+        self.start_time = time.time()
+    
+    def start(self, total):
+        """Create empty output files for a run over `total` fics."""
+        self.total = total
+        self.settled_count = 0
+        self.md_entries = []
+        self.first_result_time = None
+        self.start_time = time.time()
+        self.__write_markdown()
+        if 'jsonl' in self.formats:
+            write_file_atomically(self.jsonl_path, lambda f: None)
+        if 'csv' in self.formats:
+            write_file_atomically(self.csv_path, self.__write_csv_header)
+    
+    def add_settled(self, fic):
+        """
+        Record a fic whose final position is now known.
+        
+        Fics must be passed in rank order; the first call is position 1.
+        """
+        self.settled_count += 1
+        position = self.settled_count
+        if self.first_result_time is None:
+            self.first_result_time = time.time() - self.start_time
+            print(f"First settled result after {self.first_result_time:.1f}s")
+        
+        if 'jsonl' in self.formats:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(fic_to_json_line(fic, position))
+        if 'csv' in self.formats:
+            with open(self.csv_path, 'a', encoding='utf-8', newline='') as f:
+                csv.DictWriter(f, fieldnames=['position'] + OUTPUT_FIELDS).writerow(fic_to_csv_row(fic, position))
+        if 'md' in self.formats:
+            self.md_entries.append(format_fic_markdown(fic, position))
+            self.__write_markdown()
+    
+    def write_snapshot(self, fics):
+        """
+        Atomically replace all outputs with a provisional ordering.
+        
+        Used by ranking methods where positions can still change (e.g. scoring,
+        where each batch may reshuffle the list).
+        """
+        self.md_entries = [format_fic_markdown(fic, idx) for idx, fic in enumerate(fics, 1)]
+        self.settled_count = len(fics)
+        if self.first_result_time is None and fics:
+            self.first_result_time = time.time() - self.start_time
+            print(f"First provisional results after {self.first_result_time:.1f}s")
+        
+        if 'md' in self.formats:
+            self.__write_markdown()
+        if 'jsonl' in self.formats:
+            write_file_atomically(
+                self.jsonl_path,
+                lambda f: f.writelines(fic_to_json_line(fic, idx) for idx, fic in enumerate(fics, 1))
+            )
+        if 'csv' in self.formats:
+            def write_csv(f):
+                self.__write_csv_header(f)
+                writer = csv.DictWriter(f, fieldnames=['position'] + OUTPUT_FIELDS)
+                writer.writerows(fic_to_csv_row(fic, idx) for idx, fic in enumerate(fics, 1))
+            write_file_atomically(self.csv_path, write_csv)
+    
+    def finalize(self, fics):
+        """Write the final ordering to every output format."""
+        self.total = len(fics)
+        self.write_snapshot(fics)
+        
+        print(f"\n{'='*80}")
+        for fmt, path in (("md", self.md_path), ("jsonl", self.jsonl_path), ("csv", self.csv_path)):
+            if fmt in self.formats:
+                print(f"Output file created: {path}")
+        print(f"{'='*80}\n")
+    
+    def __write_csv_header(self, f):
+        csv.DictWriter(f, fieldnames=['position'] + OUTPUT_FIELDS).writeheader()
+    
+    def __write_markdown(self):
+        if 'md' not in self.formats:
+            return
+        header = format_markdown_header(self.total, self.settled_count)
+        
+        def write_content(f):
+            f.write(header)
+            f.writelines(self.md_entries)
+        
+        write_file_atomically(self.md_path, write_content)
+
+
 def create_markdown_output(fics, filename="filtered_fics.md"):
     """
     Create a markdown file with all fics information formatted nicely.
@@ -359,123 +1258,161 @@ def create_markdown_output(fics, filename="filtered_fics.md"):
         fics: List of fic dictionaries with their information
         filename: Name of the output markdown file
     """
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write("# Filtered AO3 Fics\n\n")
-        f.write(f"**Total fics:** {len(fics)}\n\n")
-        f.write("---\n\n")
-        
+    def write_content(f):
+        f.write(format_markdown_header(len(fics)))
         for idx, fic in enumerate(fics, 1):
-            f.write(f"## {idx}. [{fic['title']}]({fic['url']})\n\n")
-            
-            if 'tournament_rank' in fic:
-                f.write(f"**Tournament Rank:** {fic['tournament_rank']}\n\n")
-            
-            if 'llm_rank' in fic:
-                f.write(f"**LLM Rank:** {fic['llm_rank']}\n\n")
-            
-            f.write(f"**Rating:** {fic['rating']}  \n")
-            f.write(f"**Category:** {fic['category']}  \n")
-            f.write(f"**Status:** {'Complete' if fic['is_complete'] else 'In Progress'}  \n")
-            f.write(f"**Chapters:** {fic['chapters']}  \n")
-            f.write(f"**Word Count:** {fic['word_count']:,}  \n\n")
-            
-            if fic['fandoms']:
-                f.write(f"**Fandoms:** {' '.join(f'`{fandom}`' for fandom in fic['fandoms'])}  \n\n")
-            
-            if fic['warnings'] != 'N/A':
-                f.write(f"**Warnings:** {fic['warnings']}  \n\n")
-            
-            if fic['relationships']:
-                f.write(f"**Relationships:** {' '.join(f'`{rel}`' for rel in fic['relationships'])}  \n\n")
-            
-            if fic['characters']:
-                f.write(f"**Characters:** {' '.join(f'`{char}`' for char in fic['characters'])}  \n\n")
-            
-            if fic['freeform_tags']:
-                f.write(f"**Tags:** {' '.join(f'`{tag}`' for tag in fic['freeform_tags'])}  \n\n")
-            
-            if fic['summary'] != 'N/A':
-                f.write("**Summary:**\n\n")
-                f.write(f"> {fic['summary']}\n\n")
-            
-            f.write(f"**Stats:** {fic['kudos']} kudos | {fic['comments']} comments  \n\n")
-            f.write("---\n\n")
+            f.write(format_fic_markdown(fic, idx))
+    
+    write_file_atomically(filename, write_content)
     
     print(f"\n{'='*80}")
     print(f"Markdown file created: {filename}")
     print(f"{'='*80}\n")
 
-async def compare_fics_batch_async(comparisons, search_param, ai):
+def parse_comparison_response(response):
+    """
+    Parse an LLM comparison verdict.
+    
+    Returns:
+        True if Fic 1 won, False if Fic 2 won, or None if the response can't be parsed
+    """
+    response_lower = response.lower()
+    
+    if "<fic 1>" in response_lower or ("fic 1" in response_lower and "fic 2" not in response_lower):
+        return True
+    elif "<fic 2>" in response_lower or ("fic 2" in response_lower and "fic 1" not in response_lower):
+        return False
+    else:
+        try:
+            fic_id = response_lower.split("<")[1].split(">")[0]
+            fic_number = int(''.join(filter(str.isdigit, fic_id)))
+            return fic_number == 1
+        except:
+            return None
+
+def build_comparison_prompt(fic1, fic2, search_param):
+    """Build the pairwise comparison prompt for two fics."""
+    return (
+        f"Fic 1:\n{format_fic_for_prompt(fic1)}\n\n"
+        f"Fic 2:\n{format_fic_for_prompt(fic2)}\n\n"
+        f"Compare these two fics strictly based on the user's preferences: {search_param}"
+    )
+
+# Comparison graphs live for the whole run, keyed by search criteria,
+# so retries and re-ranks reuse every verdict already paid for
+comparison_graphs = {}
+
+def get_comparison_graph(search_param):
+    """Get the shared ComparisonGraph for a search, creating it on first use."""
+    if search_param not in comparison_graphs:
+        comparison_graphs[search_param] = ComparisonGraph()
+    return comparison_graphs[search_param]
+
+async def compare_fics_batch_async(comparisons, search_param, ai, graph=None):
     """
     Compare multiple pairs of fics concurrently.
     
+    Pairs whose outcome the comparison graph can already infer are answered
+    without calling the LLM, and every new verdict is recorded in the graph.
+    
+    While the cascade model still has budget, each pair is also asked in swapped
+    order. When the two answers disagree (or can't be parsed) the verdict is a close
+    call and is escalated to the cascade model. Once the budget is spent, pairs are
+    asked once, as without a cascade.
+    
     Args:
         comparisons: List of tuples (fic1, fic2, comparison_num, total_comparisons)
         search_param: User's search criteria
         ai: OllamaAI instance
+        graph: Optional ComparisonGraph of earlier verdicts
     
     Returns:
         List of boolean results (True if fic1 better, False if fic2 better)
     """
+    results = [None] * len(comparisons)
+    pending = []
+    
+    for idx, (fic1, fic2, comp_num, total_comp) in enumerate(comparisons):
+        known = graph.lookup(fic1, fic2) if graph else None
+        if known is None:
+            pending.append(idx)
+        else:
+            results[idx] = known
+            print(f"{comp_num}/{total_comp}: '{fic1['title']}' vs '{fic2['title']}' -> <Fic {1 if known else 2}> (inferred)")
+    
+    if not pending:
+        return results
+    
+    # The swapped-order probe only pays off while a close call can still be escalated
+    use_cascade = ai.can_escalate()
+    
     async with aiohttp.ClientSession() as session:
         tasks = []
-        for fic1, fic2, comp_num, total_comp in comparisons:
-            fic1_tags = ', '.join(fic1.get('freeform_tags', [])) or 'None'
-            fic2_tags = ', '.join(fic2.get('freeform_tags', [])) or 'None'
+        for fic1, fic2, comp_num, total_comp in (comparisons[idx] for idx in pending):
+            tasks.append(ai.send_message_async(build_comparison_prompt(fic1, fic2, search_param), session))
+            if use_cascade:
+                tasks.append(ai.send_message_async(build_comparison_prompt(fic2, fic1, search_param), session))
+        
+        # Failed requests come back as exceptions and give no verdict
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
+        step = 2 if use_cascade else 1
+        
+        close_calls = []
+        for pos, idx in enumerate(pending):
+            fic1, fic2, comp_num, total_comp = comparisons[idx]
+            response = responses[pos * step]
+            if isinstance(response, Exception):
+                print(f"{comp_num}/{total_comp}: '{fic1['title']}' vs '{fic2['title']}' -> request failed ({type(response).__name__})")
+                verdict = None
+            else:
+                print(f"{comp_num}/{total_comp}: '{fic1['title']}' vs '{fic2['title']}' -> {response.strip()}")
+                verdict = parse_comparison_response(response)
             
-            fic1_summary = (
-                f"Title: {fic1['title']}\n"
-                f"Fandoms: {', '.join(fic1['fandoms'])}\n"
-                f"Warnings: {fic1['warnings']}\n"
-                f"Warnings Tags: {', '.join(fic1['warnings_tags'])}\n"
-                f"Relationships: {', '.join(fic1['relationships'])}\n"
-                f"Characters: {', '.join(fic1['characters'])}\n"
-                f"Tags: {', '.join(fic1['freeform_tags'])}\n"
-                f"Summary: {fic1['summary']}\n"
-                f"Word Count: {fic1['word_count']}\n"
-            )
-            fic2_summary = (
-                f"Title: {fic2['title']}\n"
-                f"Fandoms: {', '.join(fic2['fandoms'])}\n"
-                f"Warnings: {fic2['warnings']}\n"
-                f"Warnings Tags: {', '.join(fic2['warnings_tags'])}\n"
-                f"Relationships: {', '.join(fic2['relationships'])}\n"
-                f"Characters: {', '.join(fic2['characters'])}\n"
-                f"Tags: {', '.join(fic2['freeform_tags'])}\n"
-                f"Summary: {fic2['summary']}\n"
-                f"Word Count: {fic2['word_count']}\n"
-            )
+            if use_cascade:
+                swapped_response = responses[pos * step + 1]
+                if isinstance(swapped_response, Exception):
+                    print(f"{comp_num}/{total_comp}: swapped-order request failed ({type(swapped_response).__name__})")
+                    swapped = None
+                else:
+                    swapped = parse_comparison_response(swapped_response)
+                if graph and verdict is not None and verdict == swapped:
+                    graph.record_conflict(fic1, fic2)
+                if verdict is None or swapped is None or verdict == swapped:
+                    if verdict is None and swapped is not None:
+                        verdict = not swapped
+                    close_calls.append(idx)
             
-            prompt = (
-                
-                f"Fic 1:\n{fic1_summary}\n\n"
-                f"Fic 2:\n{fic2_summary}\n\n"
-                f"Compare these two fics strictly based on the user's preferences: {search_param}"
-            )
-            tasks.append(ai.send_message_async(prompt, session))
+            results[idx] = verdict
         
-        responses = await asyncio.gather(*tasks)
-        results = []
+        escalated = []
+        for idx in close_calls[:max(0, ai.cascade_budget - ai.cascade_calls)]:
+            fic1, fic2, comp_num, total_comp = comparisons[idx]
+            prompt = build_comparison_prompt(fic1, fic2, search_param)
+            escalated.append((idx, ai.send_message_async(prompt, session, escalate=True)))
         
-        for (fic1, fic2, comp_num, total_comp), response in zip(comparisons, responses):
-            response_lower = response.lower()
-            print(f"{comp_num}/{total_comp}: '{fic1['title']}' vs '{fic2['title']}' -> {response.strip()}")
-            
-            if "<fic 1>" in response_lower or ("fic 1" in response_lower and "fic 2" not in response_lower):
-                results.append(True)
-            elif "<fic 2>" in response_lower or ("fic 2" in response_lower and "fic 1" not in response_lower):
-                results.append(False)
-            else:
-                try:
-                    fic_id = response_lower.split("<")[1].split(">")[0]
-                    fic_number = int(''.join(filter(str.isdigit, fic_id)))
-                    results.append(fic_number == 1)
-                except:
-                    results.append(random.choice([True, False]))
+        if escalated:
+            escalated_responses = await asyncio.gather(*(task for _, task in escalated), return_exceptions=True)
+            for (idx, _), response in zip(escalated, escalated_responses):
+                fic1, fic2, comp_num, total_comp = comparisons[idx]
+                if isinstance(response, Exception):
+                    print(f"{comp_num}/{total_comp}: escalation to {ai.cascade_model} failed ({type(response).__name__}), keeping screening verdict")
+                    continue
+                print(f"{comp_num}/{total_comp}: close call escalated to {ai.cascade_model} -> {response.strip()}")
+                verdict = parse_comparison_response(response)
+                if verdict is not None:
+                    results[idx] = verdict
+        
+        for idx in pending:
+            fic1, fic2, comp_num, total_comp = comparisons[idx]
+            if results[idx] is None:
+                # A coin flip isn't a verdict, so keep it out of the graph
+                results[idx] = random.choice([True, False])
+            elif graph:
+                graph.record(fic1, fic2, results[idx])
         
         return results
 
-def compare_fics_with_llm(fic1, fic2, ai, search_param, comparison_num=None, total_comparisons=None):
+def compare_fics_with_llm(fic1, fic2, ai, search_param, comparison_num=None, total_comparisons=None, graph=None):
     """
     Compare two fics using LLM and return True if fic1 is better than fic2.
     Synchronous wrapper for single comparisons.
@@ -487,106 +1424,115 @@ def compare_fics_with_llm(fic1, fic2, ai, search_param, comparison_num=None, tot
         search_param: User's search criteria
         comparison_num: Current comparison number (optional)
         total_comparisons: Total expected comparisons (optional)
+        graph: Optional ComparisonGraph of earlier verdicts
     
     Returns:
         True if fic1 is better, False if fic2 is better
     """
     comparisons = [(fic1, fic2, comparison_num or 1, total_comparisons or 1)]
-    results = asyncio.run(compare_fics_batch_async(comparisons, search_param, ai))
+    results = asyncio.run(compare_fics_batch_async(comparisons, search_param, ai, graph))
     return results[0]
 
-def merge_sorted_lists(left, right, ai, search_param, depth, state, batch_size=8):
+def play_bracket_round(pairs, ai, search_param, state, batch_size=8):
     """
-    Merge two sorted lists of fics by comparing items at the boundaries with batch processing.
+    Play one round of independent matches, `batch_size` comparisons at a time.
     
     Args:
-        left: Sorted list of fics (best to worst)
-        right: Sorted list of fics (best to worst)
+        pairs: List of (fic1, fic2) tuples, no fic appearing twice
         ai: OllamaAI instance
         search_param: User's search criteria
-        depth: Current recursion depth for logging
         state: Dictionary to track comparison progress
         batch_size: Number of comparisons to process concurrently
     
     Returns:
-        Merged sorted list (best to worst)
-    """
-    result = []
-    i = j = 0
-    
-    while i < len(left) and j < len(right):
-        # Collect batch of comparisons
-        comparisons = []
-        temp_indices = []
-        
-        while i < len(left) and j < len(right) and len(comparisons) < batch_size:
-            comparisons.append((left[i], right[j], state['current'] + len(comparisons) + 1, state['total']))
-            temp_indices.append((i, j))
-            # Look ahead to next potential comparison
-            if i + 1 < len(left) and j < len(right):
-                i += 1
-            elif i < len(left) and j + 1 < len(right):
-                j += 1
-            else:
-                break
-        
-        # Reset indices to process comparisons sequentially with batch results
-        i, j = temp_indices[0]
-        
-        # Process batch
-        if comparisons:
-            results = asyncio.run(compare_fics_batch_async(comparisons[:1], search_param, ai))
-            state['current'] += 1
-            
-            if results[0]:
-                result.append(left[i])
-                i += 1
-            else:
-                result.append(right[j])
-                j += 1
-    
-    result.extend(left[i:])
-    result.extend(right[j:])
-    
-    return result
+        List of booleans (True if fic1 won)
+    """
+    results = []
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start:start + batch_size]
+        comparisons = [
+            (fic1, fic2, state['current'] + offset + 1, state['total'])
+            for offset, (fic1, fic2) in enumerate(batch)
+        ]
+        results.extend(asyncio.run(compare_fics_batch_async(comparisons, search_param, ai, state.get('graph'))))
+        state['current'] += len(batch)
+    return results
 
-def merge_sort_fics(fics, ai, search_param, state):
+def tournament_tree_sort(fics, ai, search_param, state, batch_size=8):
     """
-    Recursively sort fics using merge sort with LLM comparisons.
+    Sort fics with a knockout tournament, emitting each place as soon as it's final.
+    
+    The first bracket is played round by round, with the matches in each round
+    run concurrently; its winner is 1st place after N-1 comparisons. Each later
+    place replays only the previous winner's path, about log2(N) comparisons.
     
     Args:
         fics: List of fic dictionaries to sort
         ai: OllamaAI instance
         search_param: User's search criteria
-        state: Dictionary to track comparison progress
+        state: Dictionary to track comparison progress; state['on_settled'] is
+            called with each fic as its place becomes final
+        batch_size: Number of first-round comparisons to process concurrently
     
     Returns:
         Sorted list of fics from best (rank 1) to worst (rank N)
     """
-    if len(fics) <= 1:
-        return fics
+    on_settled = state.get('on_settled')
     
-    if len(fics) == 2:
-        state['current'] += 1
-        if compare_fics_with_llm(fics[0], fics[1], ai, search_param, state['current'], state['total']):
-            return [fics[0], fics[1]]
-        else:
-            return [fics[1], fics[0]]
+    # levels[0] holds leaf indices; levels[l][i] is the winner of levels[l-1][2i] and [2i+1]
+    levels = [list(range(len(fics)))]
+    while len(levels[-1]) > 1:
+        previous = levels[-1]
+        pairs = [(previous[i], previous[i + 1]) for i in range(0, len(previous) - 1, 2)]
+        results = play_bracket_round([(fics[a], fics[b]) for a, b in pairs], ai, search_param, state, batch_size)
+        winners = [a if fic1_won else b for (a, b), fic1_won in zip(pairs, results)]
+        if len(previous) % 2:
+            winners.append(previous[-1])
+        levels.append(winners)
     
-    mid = len(fics) // 2
-    left_sorted = merge_sort_fics(fics[:mid], ai, search_param, state)
-    right_sorted = merge_sort_fics(fics[mid:], ai, search_param, state)
+    sorted_fics = []
+    while len(sorted_fics) < len(fics):
+        winner = levels[-1][0]
+        sorted_fics.append(fics[winner])
+        if on_settled:
+            on_settled(fics[winner])
+        
+        # Remove the winner and replay its path to the top
+        levels[0][winner] = None
+        index = winner
+        for level in range(1, len(levels)):
+            index //= 2
+            below = levels[level - 1]
+            left = below[2 * index]
+            right = below[2 * index + 1] if 2 * index + 1 < len(below) else None
+            if left is None or right is None:
+                levels[level][index] = right if left is None else left
+            else:
+                state['current'] += 1
+                fic1_won = compare_fics_with_llm(fics[left], fics[right], ai, search_param,
+                                                 state['current'], state['total'], state.get('graph'))
+                levels[level][index] = left if fic1_won else right
     
-    return merge_sorted_lists(left_sorted, right_sorted, ai, search_param, 0, state)
+    return sorted_fics
 
-def rank_fics_with_tournament(fics, search_param):
+def rank_fics_with_tournament(fics, search_param, writer=None, graph=None, cascade_model=None, cascade_budget=50,
+                              clusters=None):
     """
-    Rank fics using merge sort with LLM pairwise comparisons.
+    Rank fics using a knockout tournament with LLM pairwise comparisons.
     Establishes absolute rankings from 1st to Nth place.
     
+    If interrupted with Ctrl+C, the places settled so far are kept in order and
+    the remaining fics follow them unranked.
+    
     Args:
         fics: List of fic dictionaries to rank
         search_param: User's search criteria
+        writer: Optional ProgressiveOutputWriter, fed each fic as soon as its final position is known
+        graph: ComparisonGraph to reuse (default: the shared graph for this search_param)
+        cascade_model: Optional larger model that settles close-call comparisons
+        cascade_budget: Maximum number of comparisons the cascade model may make
+        clusters: Optional near-duplicate clusters from cluster_near_duplicates. Members are
+            placed right after their representative, and tournament ranks count them.
     
     Returns:
         List of fics sorted from best (rank 1) to worst (rank N)
@@ -604,34 +1550,107 @@ def rank_fics_with_tournament(fics, search_param):
             raise ValueError(f"Fic '{fic.get('title', 'Unknown')}' missing required fields: {missing_fields}")
     
     # ai = OllamaAI("goekdenizguelmez/JOSIEFIED-Qwen3:4b", 3, max_history_pairs=0)
-    ai = OllamaAI(ai_model, 3, max_history_pairs=0)
+    ai = OllamaAI(ai_model, 3, max_history_pairs=0, cascade_model=cascade_model, cascade_budget=cascade_budget)
     
     if len(fics) > 1:
-        expected_comparisons = int(len(fics) * 3.5)
+        expected_comparisons = int((len(fics) - 1) * math.log2(len(fics)))
     else:
         expected_comparisons = 0
     
     print(f"\nRanking {len(fics)} fics (estimated {expected_comparisons} comparisons)...\n")
     
-    state = {'current': 0, 'total': expected_comparisons}
+    if graph is None:
+        graph = get_comparison_graph(search_param)
+    # The graph is shared across rankings, so only report what this one added
+    stats_before = graph.get_stats()
+    
+    settled = []
+    placed_count = 0
+    
+    def on_settled(fic):
+        nonlocal placed_count
+        settled.append(fic)
+        # Near-duplicates go out right behind their representative, at their final positions
+        for grouped_fic in get_cluster_group(fic, clusters):
+            placed_count += 1
+            grouped_fic['tournament_rank'] = placed_count
+            if writer:
+                writer.add_settled(grouped_fic)
+    
+    state = {'current': 0, 'total': expected_comparisons, 'graph': graph, 'on_settled': on_settled}
+    
+    if writer:
+        writer.start(sum(1 + len((clusters or {}).get(fic['work_id'], [])) for fic in fics))
     
     try:
-        sorted_fics = merge_sort_fics(fics, ai, search_param, state)
-        
-        for rank, fic in enumerate(sorted_fics, 1):
-            fic['tournament_rank'] = rank
+        sorted_fics = tournament_tree_sort(fics, ai, search_param, state)
         
+        stats = {key: value - stats_before[key] for key, value in graph.get_stats().items()}
         print(f"\n✓ Ranking complete ({state['current']} comparisons)\n")
+        print(f"{stats['inferred']} comparisons answered from earlier verdicts without the LLM\n")
+        if ai.cascade_model or stats['cycles']:
+            # Cycles are only observable when pairs are asked in both orders (cascade mode)
+            print(f"{stats['cycles']} preference cycles (order-dependent verdicts) detected\n")
+        if ai.cascade_model:
+            print(f"Cascade model settled {ai.cascade_calls}/{ai.cascade_budget} budgeted close calls\n")
+        if ai.hedges_sent:
+            print(f"Hedged {ai.hedges_sent} slow requests ({ai.hedges_won} answered by the hedge)\n")
         
         return sorted_fics
         
     except KeyboardInterrupt:
-        print(f"\n\n⚠ Interrupted after {state['current']} comparisons\n")
-        return fics
+        print(f"\n\n⚠ Interrupted after {state['current']} comparisons ({len(settled)} places settled)\n")
+        settled_ids = {id(fic) for fic in settled}
+        remainder = [fic for fic in fics if id(fic) not in settled_ids]
+        for fic in remainder:
+            fic.pop('tournament_rank', None)
+        return settled + remainder
 
-def main():
+def refine_top_fics(ordered_fics, search_param, top_k=5, token_budget=1500):
+    """
+    Re-rank the top of an ordered list with the opening of chapter 1 in the prompt.
+    
+    Only the top `top_k` fics are deep-fetched and re-compared; the rest of the
+    list keeps its order.
+    
+    Args:
+        ordered_fics: List of fics sorted from best to worst
+        search_param: User's search criteria
+        top_k: Number of fics at the top of the list to refine
+        token_budget: Approximate token limit for each fic's opening text
+    
+    Returns:
+        List of fics sorted from best to worst, with the top `top_k` re-ranked
+    """
+    top_fics = ordered_fics[:top_k]
+    if len(top_fics) < 2:
+        return ordered_fics
+    
+    was_ranked = all('tournament_rank' in fic for fic in ordered_fics)
+    
+    print(f"\nRefining top {len(top_fics)} fics using the opening of chapter 1...")
+    deep_fetch_fics(top_fics, token_budget=token_budget)
+    
+    refined = rank_fics_with_tournament(top_fics, search_param)
+    if not all('tournament_rank' in fic for fic in refined):
+        print("Refinement interrupted; keeping the original order of the top fics")
+        refined = top_fics
+    
+    result = refined + ordered_fics[top_k:]
+    for fic in top_fics:
+        fic.pop('tournament_rank', None)
+    if was_ranked or refined is not top_fics:
+        ranked_count = len(result) if was_ranked else len(refined)
+        for rank, fic in enumerate(result[:ranked_count], 1):
+            fic['tournament_rank'] = rank
+    return result
+
+def main(import_path=None):
 
-    url, pages, search_param = get_user_input()
+    if import_path:
+        search_param = input("Enter what type of works you are interested in, in natural language: ")
+    else:
+        url, pages, search_param = get_user_input()
 
     # hardcoded configuration
     # url = r"""
@@ -641,18 +1660,41 @@ def main():
     # search_param = "ADD_YOUR_SEARCH_CRITERIA_HERE."
     
     
-    fics = scrape_multiple_pages(url, pages)
+    if import_path:
+        fics = import_saved_pages(import_path)
+    else:
+        fics = scrape_multiple_pages(url, pages)
     random.shuffle(fics)
     
+    # Only one fic per cluster of near-duplicates goes through the LLM
+    fics, clusters = cluster_near_duplicates(fics)
+    
+    # Results are written to filtered_fics.md/.jsonl/.csv as they settle
+    writer = ProgressiveOutputWriter("filtered_fics.md")
+    
     # Choose ranking method:
-    # Option 1: Tournament ranking (merge sort - O(N log N) comparisons)
-    ordered_fics = rank_fics_with_tournament(fics, search_param)
+    # Option 1: Tournament ranking (knockout tournament - O(N log N) comparisons, top places settle first)
+    ordered_fics = rank_fics_with_tournament(fics, search_param, writer=writer, cascade_model=cascade_model,
+                                             clusters=clusters)
     
     # Option 2: Scoring system (uncomment to use instead)
-    # ordered_fics = rank_fics_with_scoring(fics, search_param)
+    # ordered_fics = rank_fics_with_scoring(fics, search_param, writer=writer, cascade_model=cascade_model,
+    #                                       clusters=clusters)
+    
+    # Optional: re-rank the top few with the opening of chapter 1 (uncomment to use)
+    # ordered_fics = refine_top_fics(ordered_fics, search_param, top_k=5)
+    
+    ordered_fics = expand_clusters(ordered_fics, clusters)
     
-    create_markdown_output(ordered_fics)
+    writer.finalize(ordered_fics)
 
 if __name__ == "__main__":
     ai_model = "goekdenizguelmez/JOSIEFIED-Qwen3:4b"
-    main()
\ No newline at end of file
+    # Optional larger model for close calls only, e.g. "goekdenizguelmez/JOSIEFIED-Qwen3:14b"
+    cascade_model = None
+    
+    # `python main.py import <dir or tarball>` ranks saved result pages instead of scraping
+    if len(sys.argv) == 3 and sys.argv[1] == "import":
+        main(import_path=sys.argv[2])
+    else:
+        main()
\ No newline at end of file